@@ -89,6 +89,8 @@ class Image(Enum):
     DOOR_TOP = auto()
     PLAYER = auto()
     SWAMP_GRASS = auto()
+    VILLAGER = auto()
+    MONSTER = auto()
 
 
 # This image scheme dict allows us to swap fonts whenever we please.
@@ -116,6 +118,8 @@ image_scheme = {
         Image.ALTAR: (6, 1),
         Image.DOOR: (11, 2),
         Image.DOOR_TOP: (11, 2),
+        Image.VILLAGER: (2, 0),
+        Image.MONSTER: (7, 6),
     },
     "kenney": {
         Image.PLAYER: (25, 0),
@@ -140,5 +144,7 @@ image_scheme = {
         Image.ALTAR: (15, 9),
         Image.DOOR: (8, 9),
         Image.DOOR_TOP: (8, 9),
+        Image.VILLAGER: (26, 1),
+        Image.MONSTER: (28, 5),
     },
 }
@@ -0,0 +1,66 @@
+import numpy as np
+
+from tiles import Tile
+
+from typing import Iterable, Sequence
+
+
+def bit_length(values: np.ndarray) -> np.ndarray:
+    """Return the number of bits needed to hold each value of an unsigned 64-bit array."""
+    # Floats can only hold 53 bits exactly, so each 32-bit half is measured separately.
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+class ColumnIndex:
+    """Utility class that keeps a bit mask of the non-air z-levels in every column of the world.
+
+    Finding the first solid tile below any height is then a couple of bit operations per column,
+    no matter how many empty z-levels are skipped.
+    Call ``update_columns`` after changing tiles, so the index stays in sync with the world.
+    """
+    MAX_DEPTH = 64
+
+    def __init__(self, tiles: np.ndarray):
+        if tiles.shape[2] > self.MAX_DEPTH:
+            raise ValueError(f"Column index only supports worlds up to {self.MAX_DEPTH} z-levels deep.")
+        self.tiles = tiles
+        self.bits = np.left_shift(np.uint64(1), np.arange(tiles.shape[2], dtype=np.uint64))
+        self.mask = np.zeros(tiles.shape[:2], np.uint64)
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Recalculate the mask of every column."""
+        self.mask[:] = np.bitwise_or.reduce((self.tiles != Tile.AIR) * self.bits, axis=-1)
+
+    def update_columns(self, columns: Iterable[tuple[int, int]]) -> None:
+        """Recalculate the masks of the given (x, y) columns after the tiles in them were changed."""
+        columns = np.array(list(columns), np.intp).reshape(-1, 2)
+        xs, ys = columns[:, 0], columns[:, 1]
+        self.mask[xs, ys] = np.bitwise_or.reduce((self.tiles[xs, ys] != Tile.AIR) * self.bits, axis=-1)
+
+    def first_below(self, z: int, mask: np.ndarray = None) -> np.ndarray:
+        """Return the z-level of the first non-air tile at or below ``z`` in each column, or -1 if there is none.
+
+        Uses the masks of the whole world unless a slice of them is given.
+        """
+        mask = self.mask if mask is None else mask
+        z = min(z, self.tiles.shape[2] - 1)
+        if z < 0:
+            return np.full(mask.shape, -1, np.int32)
+        below = mask & np.uint64((1 << (z + 1)) - 1)
+        return bit_length(below).astype(np.int32) - 1
+
+    def first_below_view(self, z: int, pos: Sequence[float], size: Sequence[int]) -> np.ndarray:
+        """Like ``first_below``, but only for a rectangle of columns starting at ``pos``.
+
+        Columns outside the world are -1, so a camera can be partly off the edge of the map.
+        """
+        x, y = int(pos[0]), int(pos[1])
+        view = np.zeros((size[0], size[1]), np.uint64)
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + size[0], self.mask.shape[0]), min(y + size[1], self.mask.shape[1])
+        if left < right and top < bottom:
+            view[left - x:right - x, top - y:bottom - y] = self.mask[left:right, top:bottom]
+        return self.first_below(z, view)
@@ -0,0 +1,213 @@
+from collections import deque
+import random
+
+import numpy as np
+
+from tiles import Tile
+
+from typing import Optional
+
+
+# How far the dungeon reaches out from the altar room in x and y.
+DUNGEON_RADIUS = 24
+# BSP areas are never split smaller than this, and each holds one room at least this big.
+MIN_LEAF_SIZE = 10
+MIN_ROOM_SIZE = 4
+# The stairs down from the altar room start this far from the altar, in the middle of the room,
+# and head in the given direction.
+ENTRANCE_OFFSET = (3, 0)
+ENTRANCE_DIRECTION = (0, 1)
+
+Point = tuple[int, int]
+
+
+class DungeonLevel:
+    """Utility class for holding the layout of one dungeon level, in coordinates relative to the dungeon bounds.
+
+    Stairs are given by the top cell ``s`` and a direction ``d``. The top stair sits in the floor of the
+    upper level at ``s``, the bottom stair in the lower level at ``s + d``, and the lower level is
+    entered at ``s + 2d``. The lower level keeps ``s`` solid, so walking back into it climbs the stairs.
+    """
+    def __init__(self, open_cells: np.ndarray, up_stairs: tuple[Point, Point],
+                 down_stairs: Optional[tuple[Point, Point]]):
+        self.open_cells = open_cells
+        self.up_stairs = up_stairs
+        self.down_stairs = down_stairs
+
+
+def carve_corridor(open_cells: np.ndarray, start: Point, end: Point, rng: random.Random) -> None:
+    """Carve an L-shaped corridor between two points, turning either horizontally or vertically first."""
+    (x1, y1), (x2, y2) = start, end
+    corner = (x2, y1) if rng.random() < 0.5 else (x1, y2)
+    for (ax, ay), (bx, by) in ((start, corner), (corner, end)):
+        open_cells[min(ax, bx):max(ax, bx) + 1, min(ay, by):max(ay, by) + 1] = True
+
+
+def split(rect: tuple[int, int, int, int], open_cells: np.ndarray, rng: random.Random) -> Point:
+    """Split an area in two until it is small, put a room in each piece and connect the pieces together.
+
+    Returns the center of one of the rooms in the area, which the caller connects to the other half.
+    """
+    x, y, width, height = rect
+    can_split_x, can_split_y = width >= MIN_LEAF_SIZE * 2, height >= MIN_LEAF_SIZE * 2
+    if not can_split_x and not can_split_y:
+        # This is a leaf, so put a room in it.
+        room_width = rng.randint(min(MIN_ROOM_SIZE, width - 2), width - 2)
+        room_height = rng.randint(min(MIN_ROOM_SIZE, height - 2), height - 2)
+        room_x = x + rng.randint(1, width - room_width - 1)
+        room_y = y + rng.randint(1, height - room_height - 1)
+        open_cells[room_x:room_x + room_width, room_y:room_y + room_height] = True
+        return room_x + room_width // 2, room_y + room_height // 2
+    # Split across the longer side, so the pieces stay roughly square.
+    if can_split_x and (not can_split_y or width > height or (width == height and rng.random() < 0.5)):
+        cut = rng.randint(MIN_LEAF_SIZE, width - MIN_LEAF_SIZE)
+        first, second = (x, y, cut, height), (x + cut, y, width - cut, height)
+    else:
+        cut = rng.randint(MIN_LEAF_SIZE, height - MIN_LEAF_SIZE)
+        first, second = (x, y, width, cut), (x, y + cut, width, height - cut)
+    center = split(first, open_cells, rng)
+    carve_corridor(open_cells, center, split(second, open_cells, rng), rng)
+    return center
+
+
+def connect(open_cells: np.ndarray, start: Point, blocked: Point) -> None:
+    """Carve paths until every open cell can be reached from ``start``, without ever opening ``blocked``."""
+    width, height = open_cells.shape
+    reached = np.zeros_like(open_cells)
+    frontier = deque([start])
+    reached[start] = True
+    while True:
+        # Flood out from the start through the open cells.
+        while frontier:
+            x, y = frontier.popleft()
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if 0 <= nx < width and 0 <= ny < height and open_cells[nx, ny] and not reached[nx, ny]:
+                    reached[nx, ny] = True
+                    frontier.append((nx, ny))
+        unreached = np.argwhere(open_cells & ~reached)
+        if not len(unreached):
+            return
+        # Dig the shortest path from a stranded cell back to the reached cells.
+        target = tuple(unreached[0].tolist())
+        came_from = {target: None}
+        search = deque([target])
+        while search:
+            x, y = cell = search.popleft()
+            if reached[cell]:
+                break
+            for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if 0 <= nx < width and 0 <= ny < height and (nx, ny) != blocked and (nx, ny) not in came_from:
+                    came_from[nx, ny] = cell
+                    search.append((nx, ny))
+        while cell is not None:
+            open_cells[cell] = True
+            cell = came_from[cell]
+        frontier.append(target)  # The path and the stranded cells get flooded on the next pass.
+        reached[target] = True
+
+
+class DungeonGenerator:
+    """Utility class for building the levels of the dungeon under the altar room, one level at a time.
+
+    Nothing is generated until a level is needed. Layouts only depend on the seed and the level number,
+    so a level always comes out the same. Each level is a layer of rooms and corridors with a solid floor,
+    two z-levels below the one above it, joined to it by a pair of stairs.
+    """
+    def __init__(self, tiles: np.ndarray, seed: int, altar: tuple[int, int, int]):
+        self.tiles = tiles
+        self.seed = seed
+        width, height, _ = tiles.shape
+        self.bounds = (max(altar[0] - DUNGEON_RADIUS, 1), max(altar[1] - DUNGEON_RADIUS, 1),
+                       min(altar[0] + DUNGEON_RADIUS, width - 1), min(altar[1] + DUNGEON_RADIUS, height - 1))
+        self.entrance_z = altar[2]
+        entrance = altar[0] + ENTRANCE_OFFSET[0] - self.bounds[0], altar[1] + ENTRANCE_OFFSET[1] - self.bounds[1]
+        self.entrance = entrance, ENTRANCE_DIRECTION
+        # Each level needs a floor under it, and the bottom of the world stays solid.
+        self.level_count = max((self.entrance_z - 3) // 2, 0)
+        self.layouts: dict[int, DungeonLevel] = {}
+        self.built = 0
+
+    @classmethod
+    def from_altar(cls, tiles: np.ndarray, seed: int) -> Optional["DungeonGenerator"]:
+        """Find the altar in the world and set up a generator below it, or return None if there is no altar."""
+        altars = np.argwhere(tiles == Tile.ALTAR)
+        if not len(altars):
+            return None
+        return cls(tiles, seed, tuple(altars[0].tolist()))
+
+    def level_z(self, level: int) -> int:
+        """Return the z-level the given dungeon level is walked on."""
+        return self.entrance_z - 2 * (level + 1)
+
+    def layout(self, level: int) -> DungeonLevel:
+        """Return the layout of a level, generating and remembering it the first time."""
+        if level in self.layouts:
+            return self.layouts[level]
+        up_stairs = self.entrance if level == 0 else self.layout(level - 1).down_stairs
+        rng = random.Random(f"{self.seed}:{level}")
+        width, height = self.bounds[2] - self.bounds[0], self.bounds[3] - self.bounds[1]
+        open_cells = np.zeros((width, height), bool)
+        split((0, 0, width, height), open_cells, rng)
+        # Connect the bottom of the stairs from above to the rest of the level.
+        (top_x, top_y), (dx, dy) = up_stairs
+        arrival = top_x + dx * 2, top_y + dy * 2
+        open_cells[arrival] = True
+        open_cells[top_x + dx, top_y + dy] = False  # The stairs are added when the level is built.
+        open_cells[top_x, top_y] = False
+        connect(open_cells, arrival, (top_x, top_y))
+        down_stairs = None
+        if level + 1 < self.level_count:
+            down_stairs = self.find_down_stairs(open_cells, up_stairs, rng)
+        self.layouts[level] = DungeonLevel(open_cells, up_stairs, down_stairs)
+        return self.layouts[level]
+
+    @staticmethod
+    def find_down_stairs(open_cells: np.ndarray, up_stairs: tuple[Point, Point],
+                         rng: random.Random) -> Optional[tuple[Point, Point]]:
+        """Pick a spot in the level for the stairs down, with room to walk onto them and land below them.
+
+        The cell past the top stair has to be solid, because the hole cut under it for the bottom stair
+        would turn it into a pit that nobody can walk across.
+        """
+        width, height = open_cells.shape
+        (top_x, top_y), (dx, dy) = up_stairs
+        taken = {(top_x, top_y), (top_x + dx, top_y + dy), (top_x + dx * 2, top_y + dy * 2)}
+        candidates = np.argwhere(open_cells).tolist()
+        rng.shuffle(candidates)
+        for x, y in candidates:
+            dx, dy = rng.choice(((1, 0), (-1, 0), (0, 1), (0, -1)))
+            # The stairs need an open cell to step from, and must land inside the dungeon.
+            if (0 <= x - dx < width and 0 <= y - dy < height and open_cells[x - dx, y - dy] and
+                    0 <= x + dx * 2 < width and 0 <= y + dy * 2 < height and not open_cells[x + dx, y + dy] and
+                    not taken & {(x - dx, y - dy), (x, y), (x + dx, y + dy)}):
+                return (x, y), (dx, dy)
+        return None
+
+    def build(self, level: int) -> list[tuple[int, int, int]]:
+        """Carve a level into the world and return the positions that changed."""
+        layout = self.layout(level)
+        z = self.level_z(level)
+        left, top = self.bounds[:2]
+        changes = []
+
+        def place(x: int, y: int, tile_z: int, tile: Tile) -> None:
+            if self.tiles[left + x, top + y, tile_z] != tile:
+                self.tiles[left + x, top + y, tile_z] = tile
+                changes.append((left + x, top + y, tile_z))
+
+        for x, y in np.argwhere(layout.open_cells).tolist():
+            place(x, y, z, Tile.AIR)
+        # The stairs coming down from above. The top stair is in the floor of the level above.
+        (top_x, top_y), (dx, dy) = layout.up_stairs
+        place(top_x, top_y, z + 1, Tile.STONE_STAIRS)
+        place(top_x + dx, top_y + dy, z + 1, Tile.AIR)
+        place(top_x + dx, top_y + dy, z, Tile.STONE_STAIRS)
+        return changes
+
+    def ensure(self, z: int) -> list[tuple[int, int, int]]:
+        """Build every level that is visible from the given z-level, and return the positions that changed."""
+        changes = []
+        while self.built < self.level_count and self.level_z(self.built) >= z - 1:
+            changes += self.build(self.built)
+            self.built += 1
+        return changes
@@ -0,0 +1,210 @@
+from enum import IntEnum, auto
+
+import numpy as np
+
+import utils
+from colors import Color, Image
+from columns import ColumnIndex
+from tiles import Tile, TileFlag, tile_flags
+
+from typing import Sequence
+
+
+class EntityKind(IntEnum):
+    """Utility class for storing unique entity type IDs."""
+    VILLAGER = auto()
+    MONSTER = auto()
+
+
+# Each graphic consists of IMAGE, COLOR.
+entity_graphics = {
+    EntityKind.VILLAGER: (Image.VILLAGER, Color.CYAN),
+    EntityKind.MONSTER: (Image.MONSTER, Color.RED),
+}
+
+# The moves a wandering entity picks from each tick. Standing still is in twice, so they rest a third of the time.
+MOVES = np.array(((0, 0, 0), (0, -1, 0), (0, 1, 0), (-1, 0, 0), (1, 0, 0), (0, 0, 0)), np.int32)
+UP = np.array((0, 0, 1), np.int32)
+
+
+class SpatialHash:
+    """Utility class for finding entities near a point, by sorting them into a uniform grid of square cells.
+
+    Entities are sorted by cell, so each cell's entities sit next to each other in ``order``,
+    between ``starts[cell]`` and ``starts[cell + 1]``. Rebuild it whenever the entities move.
+    """
+    def __init__(self, size: Sequence[int], cell_size: int = 8):
+        self.cell_size = cell_size
+        self.grid_size = -(-size[0] // cell_size), -(-size[1] // cell_size)
+        self.order = np.zeros(0, np.intp)
+        self.starts = np.zeros(self.grid_size[0] * self.grid_size[1] + 1, np.intp)
+
+    def cells(self, positions: np.ndarray) -> np.ndarray:
+        """Return the cell number of each (x, y) position."""
+        return positions[:, 0] // self.cell_size * self.grid_size[1] + positions[:, 1] // self.cell_size
+
+    def build(self, ids: np.ndarray, positions: np.ndarray) -> None:
+        """Sort the entities with the given IDs into their cells."""
+        cells = self.cells(positions)
+        counts = np.bincount(cells, minlength=len(self.starts) - 1)
+        self.starts[1:] = np.cumsum(counts)
+        self.order = ids[np.argsort(cells, kind="stable")]
+
+    def query(self, corner: Sequence[int], size: Sequence[int]) -> np.ndarray:
+        """Return the IDs of the entities in every cell touched by the rectangle, which may include a few outside it."""
+        x_min, y_min = max(int(corner[0]) // self.cell_size, 0), max(int(corner[1]) // self.cell_size, 0)
+        x_max = min((int(corner[0]) + int(size[0]) - 1) // self.cell_size, self.grid_size[0] - 1)
+        y_max = min((int(corner[1]) + int(size[1]) - 1) // self.cell_size, self.grid_size[1] - 1)
+        if x_min > x_max or y_min > y_max:
+            return np.zeros(0, np.intp)
+        # Each row of cells in the rectangle is one unbroken run of the sorted entities.
+        rows = np.arange(x_min, x_max + 1) * self.grid_size[1]
+        return np.concatenate([self.order[self.starts[row + y_min]:self.starts[row + y_max + 1]] for row in rows])
+
+
+class EntityStore:
+    """Utility class for holding every entity in the world in a few flat arrays, one row per entity.
+
+    Entities are moved, looked up and drawn in batches, so the cost of a tick grows
+    with the number of entities rather than with the number of Python objects.
+    """
+    TICK_RATE = 4  # Ticks per second, independent of the frame rate.
+    MAX_TICKS_PER_UPDATE = 2
+    CHASE_RADIUS = 8  # Monsters closer than this to the player walk towards them.
+
+    def __init__(self, tiles: np.ndarray, seed: int, capacity: int = 64):
+        self.tiles = tiles
+        self.rng = np.random.default_rng(seed)
+        self.positions = np.zeros((capacity, 3), np.int32)
+        self.kinds = np.zeros(capacity, np.uint8)
+        self.alive = np.zeros(capacity, bool)
+        self.count = 0
+        self.spatial_hash = SpatialHash(tiles.shape)
+        self.clock = utils.FixedStep(self.TICK_RATE, self.MAX_TICKS_PER_UPDATE)
+
+    def add(self, positions: np.ndarray, kind: EntityKind) -> np.ndarray:
+        """Add a batch of entities of one kind at the given (x, y, z) positions and return their IDs."""
+        positions = np.asarray(positions, np.int32).reshape(-1, 3)
+        ids = np.arange(self.count, self.count + len(positions))
+        if self.count + len(positions) > len(self.alive):
+            # Grow the arrays to at least double their size, so adding entities one by one stays cheap.
+            capacity = max(len(self.alive) * 2, self.count + len(positions))
+            self.positions = np.resize(self.positions, (capacity, 3))
+            self.kinds = np.resize(self.kinds, capacity)
+            self.alive = np.concatenate((self.alive[:self.count], np.zeros(capacity - self.count, bool)))
+        self.positions[ids] = positions
+        self.kinds[ids] = kind
+        self.alive[ids] = True
+        self.count += len(positions)
+        self.rehash()
+        return ids
+
+    def remove(self, ids: np.ndarray) -> None:
+        """Remove entities from the world. Their IDs are never reused."""
+        self.alive[ids] = False
+        self.rehash()
+
+    def spawn(self, index: ColumnIndex, count: int, kind: EntityKind) -> np.ndarray:
+        """Add up to ``count`` entities standing on top of random columns, and return their IDs."""
+        width, height, depth = self.tiles.shape
+        # Pick distinct columns, so no two entities start on the same tile.
+        columns = np.unique(self.rng.integers(width * height, size=count))
+        x, y = columns // height, columns % height
+        z = index.first_below(depth - 1, index.mask[x, y]) + 1
+        # Only keep the spots with room to stand, on the ground rather than water, tree tops or roofs.
+        ok = (z > 0) & (z < depth)
+        ok[ok] = tile_flags[self.tiles[x[ok], y[ok], z[ok] - 1]] & TileFlag.GROUND != 0
+        return self.add(np.stack((x, y, z), axis=1)[ok], kind)
+
+    def rehash(self) -> None:
+        """Sort the living entities into the spatial hash."""
+        ids = np.flatnonzero(self.alive[:self.count])
+        self.spatial_hash.build(ids, self.positions[ids])
+
+    def in_view(self, corner: Sequence[float], size: Sequence[int], z_level: int) -> np.ndarray:
+        """Return the IDs of the entities inside the camera view rectangle and on the given z-level."""
+        ids = self.spatial_hash.query(corner, size)
+        positions = self.positions[ids]
+        inside = ((positions[:, 0] >= corner[0]) & (positions[:, 0] < corner[0] + size[0]) &
+                  (positions[:, 1] >= corner[1]) & (positions[:, 1] < corner[1] + size[1]) &
+                  (positions[:, 2] == z_level))
+        return ids[inside]
+
+    def occupied(self, pos: Sequence[int]) -> bool:
+        """Return whether an entity is standing at the (x, y, z) position."""
+        ids = self.spatial_hash.query(pos[:2], (1, 1))
+        return bool(np.all(self.positions[ids] == pos, axis=1).any())
+
+    def lookup(self, positions: np.ndarray) -> np.ndarray:
+        """Return the tile at each position. Everything outside the world counts as stone."""
+        inside = np.all((positions >= 0) & (positions < self.tiles.shape), axis=1)
+        clipped = np.clip(positions, 0, np.array(self.tiles.shape) - 1)
+        return np.where(inside, self.tiles[clipped[:, 0], clipped[:, 1], clipped[:, 2]], Tile.STONE)
+
+    def resolve_moves(self, positions: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        """Work out where each entity ends up when it tries to move in a direction.
+
+        The player moves by these rules too: no walking into solid tiles or off ledges,
+        walking down onto slopes, and climbing up from a slope by walking into a wall.
+        """
+        targets = positions + directions
+        target_tiles = self.lookup(targets)
+        target_flags = tile_flags[target_tiles]
+        below_flags = tile_flags[self.lookup(targets - UP)]
+        passable = (target_flags & TileFlag.PASSABLE) != 0
+        open_air = passable & (target_tiles == Tile.AIR)
+        descend = open_air & ((below_flags & TileFlag.SLOPE) != 0)
+        pit = open_air & ~descend & ((below_flags & TileFlag.PASSABLE) != 0)
+        walk = passable & ~descend & ~pit
+        climb = (~passable & ((tile_flags[self.lookup(positions)] & TileFlag.SLOPE) != 0) &
+                 (self.lookup(positions + UP) == Tile.AIR) &
+                 ((tile_flags[self.lookup(targets + UP)] & TileFlag.PASSABLE) != 0))
+        result = positions.copy()
+        result[walk] = targets[walk]
+        result[descend] = targets[descend] - UP
+        result[climb] = targets[climb] + UP
+        return result
+
+    def tick(self, player_pos: Sequence[float]) -> None:
+        """Move every entity one step. Monsters near the player walk towards them, everything else wanders."""
+        ids = np.flatnonzero(self.alive[:self.count])
+        positions = self.positions[ids]
+        directions = MOVES[self.rng.integers(len(MOVES), size=len(ids))]
+        # Only the monsters in the spatial hash cells around the player need checking.
+        # The cells reach further than the chase radius, and cover every z-level, so filter them again.
+        player = np.array(player_pos, np.int32)
+        nearby = self.spatial_hash.query(player[:2] - self.CHASE_RADIUS, (self.CHASE_RADIUS * 2 + 1,) * 2)
+        distance = np.abs(self.positions[nearby] - player)
+        nearby = nearby[(self.kinds[nearby] == EntityKind.MONSTER) &
+                        (distance[:, :2].max(axis=1) <= self.CHASE_RADIUS) & (distance[:, 2] == 0)]
+        chasers = np.isin(ids, nearby)
+        offset = player - positions[chasers]
+        step = np.zeros_like(offset)
+        along_x = np.abs(offset[:, 0]) >= np.abs(offset[:, 1])
+        step[along_x, 0] = np.sign(offset[along_x, 0])
+        step[~along_x, 1] = np.sign(offset[~along_x, 1])
+        directions[chasers] = step
+        moved = self.resolve_moves(positions, directions)
+        # Entities can't share a tile with each other or the player. When several want the same tile, whoever
+        # is already standing there wins, then the entity with the lowest ID. Losers stay put, which can
+        # block someone else in turn, so repeat until nobody is left moving into an occupied tile.
+        stayed = np.all(moved == positions, axis=1)
+        while True:
+            keys = np.ravel_multi_index(np.concatenate((moved, player[None])).T, self.tiles.shape, mode="clip")
+            order = np.lexsort((np.arange(len(keys)), np.append(~stayed, False), keys))
+            winners = np.empty(len(keys), bool)
+            winners[order] = np.concatenate(([True], keys[order][1:] != keys[order][:-1]))
+            blocked = ~winners[:-1] & ~stayed
+            if not blocked.any():
+                break
+            moved[blocked] = positions[blocked]
+            stayed |= blocked
+        self.positions[ids] = moved
+        self.rehash()
+
+    def update(self, delta_time: float, player_pos: Sequence[float]) -> bool:
+        """Run as many ticks as the elapsed time in seconds calls for, and return whether any ran."""
+        ticks = self.clock.advance(delta_time)
+        for _ in range(ticks):
+            self.tick(player_pos)
+        return ticks > 0
@@ -0,0 +1,86 @@
+import numpy as np
+
+from typing import Sequence
+
+
+# The four directions material can move in, as (dx, dy).
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+def neighbors(array: np.ndarray) -> list[np.ndarray]:
+    """Return the value of the neighbor in each direction of each cell, repeating the edge values past the edges."""
+    padded = np.pad(array, 1, mode="edge")
+    return [padded[1 + dx:padded.shape[0] - 1 + dx, 1 + dy:padded.shape[1] - 1 + dy] for dx, dy in DIRECTIONS]
+
+
+def shift(array: np.ndarray, dx: int, dy: int) -> np.ndarray:
+    """Move every value of the array by (dx, dy), filling in zeros. Used to hand material over to neighbors."""
+    padded = np.pad(array, 1)
+    return padded[1 - dx:padded.shape[0] - 1 - dx, 1 - dy:padded.shape[1] - 1 - dy]
+
+
+def spread(height: np.ndarray, amount: np.ndarray) -> tuple[np.ndarray, list[np.ndarray]]:
+    """Split ``amount`` of each cell between its lower neighbors, in proportion to how much lower they are.
+
+    Returns how much of each cell is moved, and how much goes in each of the four directions.
+    """
+    drops = [np.maximum(height - other, 0) for other in neighbors(height)]
+    total = sum(drops)
+    share = np.divide(amount, total, out=np.zeros_like(total), where=total > 0)
+    return np.where(total > 0, amount, 0), [drop * share for drop in drops]
+
+
+def move(array: np.ndarray, moved: np.ndarray, parts: list[np.ndarray]) -> np.ndarray:
+    """Take ``moved`` out of each cell and add the parts to the neighbors they were sent to."""
+    array = array - moved
+    for (dx, dy), part in zip(DIRECTIONS, parts):
+        array += shift(part, dx, dy)
+    return array
+
+
+def thermal_erosion(altitude: np.ndarray, iterations: int, talus: float = 0.04, rate: float = 0.25) -> np.ndarray:
+    """Crumble slopes steeper than ``talus`` until they settle, moving material to the cells below them."""
+    altitude = altitude.copy()
+    for _ in range(iterations):
+        steepest = altitude - np.minimum.reduce(neighbors(altitude))
+        amount = np.maximum(steepest - talus, 0) * rate
+        altitude = move(altitude, *spread(altitude, amount))
+    return altitude
+
+
+def hydraulic_erosion(altitude: np.ndarray, iterations: int, rain: float = 0.01, solubility: float = 0.2,
+                      evaporation: float = 0.1, capacity: float = 0.5) -> np.ndarray:
+    """Rain on the terrain and let the water wear it down, carrying the sediment downhill.
+
+    Each iteration rains on every cell, dissolves some terrain into the water, flows the water and its
+    sediment to lower neighbors, then evaporates some water and drops the sediment it can no longer carry.
+    """
+    altitude = altitude.copy()
+    water = np.zeros_like(altitude)
+    sediment = np.zeros_like(altitude)
+    for _ in range(iterations):
+        water += rain
+        dissolved = water * solubility
+        altitude -= dissolved
+        sediment += dissolved
+        # Level out the water surface with the lower neighbors, but never move more water than there is.
+        surface = altitude + water
+        steepest = surface - np.minimum.reduce(neighbors(surface))
+        moved, parts = spread(surface, np.minimum(water, np.maximum(steepest, 0) / 2))
+        carried = np.divide(sediment * moved, water, out=np.zeros_like(water), where=water > 0)
+        carried_parts = [np.divide(sediment * part, water, out=np.zeros_like(water), where=water > 0)
+                         for part in parts]
+        water = move(water, moved, parts)
+        sediment = move(sediment, carried, carried_parts)
+        water *= 1 - evaporation
+        deposited = np.maximum(sediment - water * capacity, 0)
+        sediment -= deposited
+        altitude += deposited
+    return altitude + sediment  # Whatever is still being carried settles where it is.
+
+
+def erode(altitude: Sequence[Sequence[float]], thermal_iterations: int, hydraulic_iterations: int) -> np.ndarray:
+    """Run the hydraulic erosion and then the thermal erosion over an altitude grid."""
+    altitude = np.asarray(altitude, np.float64)
+    altitude = hydraulic_erosion(altitude, hydraulic_iterations)
+    return thermal_erosion(altitude, thermal_iterations)
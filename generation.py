@@ -1,23 +1,45 @@
 from enum import Enum, auto
 import random
 
+import numpy as np
 import opensimplex
 
-from utils import array3d, array2d
+from utils import array3d
+from erosion import erode
+from hydrology import carve_rivers_and_lakes
+from noisecache import NoiseCache, noise_grid
 import structures
 from tiles import Tile
 
-from typing import Sequence
+from typing import Optional, Sequence
 
 
 WorldArrayType = list[list[list[Tile]]]
 
+# How many times each erosion pass runs over the altitude before the terrain is built.
+THERMAL_EROSION_ITERATIONS = 50
+HYDRAULIC_EROSION_ITERATIONS = 50
+
+# Columns with at least this many columns draining through them become rivers.
+RIVER_THRESHOLD = 24
+
 
 def get_tile(array: WorldArrayType, pos: Sequence[float]) -> Tile:
     """Utility function for easily getting tiles from an array using 3D vectors."""
     return array[int(pos[0])][int(pos[1])][int(pos[2])]
 
 
+def world_to_array(array: WorldArrayType) -> np.ndarray:
+    """Copy the world into a NumPy array of tile IDs, so it can be processed a whole slab at a time."""
+    return np.array(array, np.uint8)
+
+
+def array_to_world(tiles: np.ndarray) -> WorldArrayType:
+    """Turn a NumPy array of tile IDs back into a world of Tiles."""
+    tiles_by_id = {tile.value: tile for tile in Tile}
+    return [[[tiles_by_id[tile] for tile in column] for column in row] for row in tiles.tolist()]
+
+
 class Biome(Enum):
     """Utility class for storing unique biome IDs."""
     SWAMP = auto()
@@ -64,13 +86,6 @@ def spawn_structure(structure: list[str], array: WorldArrayType, pos: tuple[int,
         z += 1
 
 
-def noise_array(size: Sequence[int], scale: float = 1.0, offset: tuple[int, int] = (0, 0)) -> list[list[float]]:
-    """Generate a 2D array of noise values with the given scaling and offset applied."""
-    def get_point(x: int, y: int) -> float:
-        return opensimplex.noise2(x * scale + offset[0], y * scale + offset[1])
-    return array2d(size, get_point)
-
-
 def get_random_offset(size: Sequence[int], rng: random.Random) -> tuple[int, int]:
     """Utility function for generating offsets for noise layers.
 
@@ -103,6 +118,26 @@ def get_dungeon_spawn_pos(sea_level: int, array: WorldArrayType, rng) -> tuple[i
     return 0, 0, sea_level - 3  # When in doubt, fall back to (0, 0).
 
 
+def get_sea_level(size: Sequence[int]) -> int:
+    """Utility function for getting the sea level, which leaves the same room above it in every world size.
+
+    Deeper worlds just get more stone below the surface, for the dungeon to dig into.
+    """
+    return size[2] - 9
+
+
+def get_player_spawn_pos(sea_level: int, array: WorldArrayType, rng) -> tuple[int, int, int]:
+    """Utility function for finding a dry spot on the surface for the player to start on."""
+    attempts = 100  # 100 attempts until we give up and place the player at (0, 0, 0).
+    while attempts > 0:
+        x, y = rng.randrange(len(array)), rng.randrange(len(array[0]))
+        if array[x][y][sea_level] is not Tile.WATER and array[x][y][sea_level + 1] in (
+           Tile.AIR, Tile.RED_FLOWER, Tile.YELLOW_FLOWER):
+            return x, y, sea_level + 1
+        attempts -= 1
+    return 0, 0, 0
+
+
 def get_biome_tile(alt, hum) -> Tile:
     if hum > 0:
         if alt < 0:
@@ -138,23 +173,34 @@ def mountain_biome(z: int, altitude: float, humidity: float, sea_level: int) ->
     return Tile.STONE
 
 
-def generate_world(size: tuple[int, int, int], seed: int):
+def generate_world(size: tuple[int, int, int], seed: int, noise_cache: Optional[NoiseCache] = None):
     """Create the entire world array.
 
     This function is a generator that yields status strings to tell the user what is happening.
+    Noise is looked up in ``noise_cache`` when one is given, so a seed that was generated before
+    doesn't have to generate its noise again.
     """
     # Seed the random generators.
     rng = random.Random(seed)
     opensimplex.seed(seed)
 
-    # Sea level will be at 7, this can be adjusted.
-    sea_level = 7
+    sea_level = get_sea_level(size)
+
+    def get_noise(layer: str, scale: float, offset: tuple[int, int] = (0, 0)) -> np.ndarray:
+        if noise_cache is None:
+            return noise_grid(size, scale, offset)
+        return noise_cache.region(seed, layer, size, scale, offset)
 
     # Create the noise arrays.
     yield "Generating altitude..."
-    altitude_array = noise_array(size, 0.05)
+    altitude_array = get_noise("altitude", 0.05)
+    yield "Eroding terrain..."
+    altitude_array = erode(altitude_array, THERMAL_EROSION_ITERATIONS, HYDRAULIC_EROSION_ITERATIONS).tolist()
     yield "Generating humidity..."
-    humidity_array = noise_array(size, 0.05, get_random_offset(size, rng))
+    humidity_array = get_noise("humidity", 0.05, get_random_offset(size, rng)).tolist()
+    yield "Carving rivers and lakes..."
+    land_levels, water_levels = (array.tolist() for array in
+                                 carve_rivers_and_lakes(altitude_array, sea_level, RIVER_THRESHOLD))
 
     # def get_cell2(x: int, y: int, z: int) -> Tile:
     #     altitude = altitude_array[x][y]
@@ -173,7 +219,8 @@ def generate_world(size: tuple[int, int, int], seed: int):
         """This function is called once for each coordinate and decides what each block is."""
         altitude = altitude_array[x][y]
         humidity = humidity_array[x][y]
-        land_level = sea_level + round(altitude * 2)
+        land_level = land_levels[x][y]
+        water_level = water_levels[x][y]
         biome_tile = Tile.GRASS if humidity > -0.2 else Tile.SAND
         if altitude < -0.1:
             biome_tile = Tile.SAND
@@ -184,11 +231,11 @@ def generate_world(size: tuple[int, int, int], seed: int):
         if z < land_level:
             return Tile.STONE
         if z == land_level:
-            if z < sea_level:
+            if z < water_level:
                 return Tile.SAND
             return biome_tile
         if z > land_level:
-            if z < sea_level + 1:
+            if z < water_level + 1:
                 return Tile.WATER
             if z == land_level + 1 and rng.random() < 0.2 and biome_tile is Tile.GRASS:
                 if humidity > 0.3:
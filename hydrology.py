@@ -0,0 +1,157 @@
+from collections import deque
+import heapq
+
+import numpy as np
+
+from typing import Sequence
+
+
+# Altitude is converted to integer heights with this many steps per unit before flooding.
+ALTITUDE_RESOLUTION = 1 << 16
+# Cells of a depression in the altitude at least this far below where it would overflow become lake.
+LAKE_DEPTH = 0.05
+
+
+def priority_flood(heights: np.ndarray, outlets: np.ndarray,
+                   epsilon: int = 1) -> tuple[np.ndarray, np.ndarray, list[int]]:
+    """Fill the depressions in a 2D grid of non-negative integer heights, so every cell drains to an outlet.
+
+    Water can leave the grid at the outlet cells and over the edges.
+    With an ``epsilon`` of 1 the filled surface always slopes slightly towards the outlets, so every cell
+    gets a place to drain to. With an ``epsilon`` of 0 depressions are filled flat, like lakes.
+    Returns the filled heights, the flat index of the cell each cell drains into (-1 for outlets),
+    and the flat indices in the order they were reached, which always puts a cell after the one it drains into.
+    """
+    width, height = heights.shape
+    # Pad the grid with a closed border, so neighbors never need bounds checks.
+    padded_height = height + 2
+    closed = np.ones((width + 2, padded_height), np.uint8)
+    closed[1:-1, 1:-1] = 0
+    levels = np.zeros((width + 2, padded_height), np.int64)
+    levels[1:-1, 1:-1] = heights
+    # The queue holds the level and index of each cell packed into one int, so it never holds tuples.
+    shift = levels.size.bit_length()
+    index_mask = (1 << shift) - 1
+    edges = np.zeros(heights.shape, bool)
+    edges[[0, -1]] = edges[:, [0, -1]] = True
+    seeds = np.flatnonzero(np.pad(edges | outlets, 1))
+    queue = ((levels.reshape(-1)[seeds] << shift) | seeds).tolist()
+    heapq.heapify(queue)
+    closed.reshape(-1)[seeds] = 1
+    # Plain lists are much faster than NumPy arrays for indexing single cells.
+    closed = bytearray(closed.reshape(-1).tobytes())
+    levels = levels.reshape(-1).tolist()
+    receivers = [-1] * len(levels)
+    order = []
+    offsets = (1, -1, padded_height, -padded_height)
+    # When filling flat, cells inside a depression all end up at the same level,
+    # so they skip the priority queue and go in a plain first in, first out queue instead.
+    pit = deque()
+    while queue or pit:
+        if pit:
+            index = pit.popleft()
+        else:
+            index = heapq.heappop(queue) & index_mask
+        level = levels[index]
+        order.append(index)
+        for offset in offsets:
+            neighbor = index + offset
+            if closed[neighbor]:
+                continue
+            closed[neighbor] = 1
+            receivers[neighbor] = index
+            if levels[neighbor] <= level and not epsilon:
+                levels[neighbor] = level
+                pit.append(neighbor)
+                continue
+            if levels[neighbor] < level + epsilon:
+                levels[neighbor] = level + epsilon
+            heapq.heappush(queue, (levels[neighbor] << shift) | neighbor)
+    # Translate everything back from the padded grid.
+    unpad = np.full(len(levels), -1, np.int64)
+    unpad.reshape(width + 2, padded_height)[1:-1, 1:-1] = np.arange(heights.size).reshape(heights.shape)
+    filled = np.array(levels, np.int64).reshape(width + 2, padded_height)[1:-1, 1:-1]
+    receivers = np.array(receivers, np.int64)
+    receivers = np.where(receivers >= 0, unpad[receivers], -1)[unpad >= 0]
+    return filled, receivers, unpad[order].tolist()
+
+
+def flow_accumulation(receivers: np.ndarray, order: list[int]) -> np.ndarray:
+    """Return the number of cells that drain through each cell, including itself."""
+    accumulation = [1] * len(receivers)
+    receiver_list = receivers.tolist()
+    for index in reversed(order):  # Cells always come after the cell they drain into.
+        if (receiver := receiver_list[index]) >= 0:
+            accumulation[receiver] += accumulation[index]
+    return np.array(accumulation, np.int64)
+
+
+def neighbor_extreme(array: np.ndarray, function, fill) -> np.ndarray:
+    """Return the minimum or maximum of the four neighbors of each cell, using ``fill`` past the edges."""
+    padded = np.pad(array, 1, constant_values=fill)
+    return function.reduce([padded[:-2, 1:-1], padded[2:, 1:-1], padded[1:-1, :-2], padded[1:-1, 2:]])
+
+
+def carve_rivers_and_lakes(altitude: Sequence[Sequence[float]], sea_level: int,
+                           river_threshold: int) -> tuple[np.ndarray, np.ndarray]:
+    """Work out where lakes and rivers go on an altitude grid.
+
+    Returns the land level and the water level of every column. Water fills everything above the land level
+    up to and including the water level. Cells with at least ``river_threshold`` cells draining through them
+    become rivers, which are carved down to the level of the sea or lake they flow into.
+    A river is never carved where its water could spill out over the land next to it.
+    """
+    altitude = np.asarray(altitude, np.float64)
+    land = sea_level + np.round(altitude * 2).astype(np.int64)
+    ocean = land < sea_level
+
+    # Work out where water drains to on the smooth altitude, not the blocky land levels.
+    smooth = np.round((altitude - altitude.min()) * ALTITUDE_RESOLUTION).astype(np.int64)
+    _, receivers, order = priority_flood(smooth, ocean)
+    accumulation = flow_accumulation(receivers, order).reshape(altitude.shape)
+
+    # Lakes are the depressions in the smooth altitude, filled flat up to where they would overflow.
+    # The land levels are too blocky to have depressions of their own, so lake beds get carved into them.
+    filled = priority_flood(smooth, ocean, 0)[0]
+    lake = filled - smooth >= LAKE_DEPTH * ALTITUDE_RESOLUTION
+    # Every cell of a depression is filled to the same height, so that height tells the lakes apart.
+    lakes, lake_ids = np.unique(filled[lake], return_inverse=True)
+    ids = np.full(altitude.shape, -1, np.int64)
+    ids[lake] = lake_ids
+    # Each lake comes up to the land level of its lowest shore, so it can never spill over the side.
+    shore = np.full(len(lakes), np.iinfo(np.int64).max, np.int64)
+    padded_ids = np.pad(ids, 1, constant_values=-1)
+    padded_land = np.pad(land, 1, constant_values=np.iinfo(np.int64).max)
+    for neighbor in (np.s_[:-2, 1:-1], np.s_[2:, 1:-1], np.s_[1:-1, :-2], np.s_[1:-1, 2:]):
+        edge = lake & (padded_ids[neighbor] != ids)
+        np.minimum.at(shore, ids[edge], padded_land[neighbor][edge])
+    water = np.full(altitude.shape, sea_level, np.int64)
+    water[lake] = shore[lake_ids]
+    lake &= water >= sea_level
+    water[~lake] = sea_level
+    land = np.where(lake, np.minimum(land, water - 1), land)
+
+    # Each river is as high as the water it flows into, so rivers never run uphill out of their banks.
+    lake_list, water_list, receiver_list = lake.reshape(-1).tolist(), water.reshape(-1).tolist(), receivers.tolist()
+    river_level = [sea_level] * len(order)
+    for index in order:  # Cells always come after the cell they drain into.
+        if (receiver := receiver_list[index]) >= 0:
+            river_level[index] = water_list[receiver] if lake_list[receiver] else river_level[receiver]
+    river_level = np.array(river_level, np.int64).reshape(altitude.shape)
+    river = (accumulation >= river_threshold) & ~ocean & ~lake & (land >= river_level)
+    carved_land = np.where(river, river_level - 1, land)
+    water[river] = river_level[river]
+
+    # Undo any carving where water would spill into the air next to it, until nothing spills.
+    while True:
+        wet = water > carved_land
+        top = np.where(wet, water, carved_land)
+        surface = np.where(wet, water, np.iinfo(np.int64).min)
+        spills = (wet & (neighbor_extreme(top, np.minimum, np.iinfo(np.int64).max) < water)) | (
+            neighbor_extreme(surface, np.maximum, np.iinfo(np.int64).min) > top)
+        if not (spills := spills & river).any():
+            break
+        river &= ~spills
+        carved_land[spills] = land[spills]
+        water[spills] = sea_level
+    return carved_land, water
@@ -0,0 +1,105 @@
+import functools
+
+import numpy as np
+
+from colors import Color
+from tiles import Tile, TileFlag, tile_flags, tile_emission
+
+from typing import Iterable
+
+
+MAX_LIGHT = 15
+# How dark a tile with no light at all gets, so unlit places are dim but still visible.
+MAX_DARKNESS = 0.8
+
+transparent_table = tile_flags & TileFlag.OPAQUE == 0
+
+
+@functools.cache
+def shade(color: tuple[int, int, int], level: int) -> tuple[int, int, int]:
+    """Darken a color for the given light level."""
+    return Color.darken(color, MAX_DARKNESS * (1 - level / MAX_LIGHT))
+
+
+def propagate(values: np.ndarray, transparent: np.ndarray, open_cells: np.ndarray) -> np.ndarray:
+    """Spread light out from every lit cell, losing one level per step, through the open transparent cells.
+
+    The cells waiting to spread are kept as arrays of flat indices, one array per light level,
+    so each step of the flood fill handles a whole ring of cells at once.
+    Cells that are not open keep their values, but still shine into their open neighbors.
+    """
+    # Pad with a closed border, so neighbor indices never need bounds checks.
+    values = np.pad(values, 1)
+    can_fill = np.pad(transparent & open_cells, 1).reshape(-1)
+    flat = values.reshape(-1)
+    offsets = np.array([1, -1, values.shape[2], -values.shape[2],
+                        values.shape[1] * values.shape[2], -values.shape[1] * values.shape[2]])
+    queues = {level: np.flatnonzero(flat == level) for level in range(2, MAX_LIGHT + 1)}
+    for level in range(MAX_LIGHT, 1, -1):
+        queue = queues[level]
+        neighbors = (queue[:, None] + offsets).reshape(-1)
+        neighbors = np.unique(neighbors[can_fill[neighbors] & (flat[neighbors] < level - 1)])
+        flat[neighbors] = level - 1
+        if level > 2:
+            queues[level - 1] = np.concatenate((queues[level - 1], neighbors))
+    return values[1:-1, 1:-1, 1:-1]
+
+
+class LightEngine:
+    """Utility class for keeping track of how brightly every tile in the world is lit.
+
+    Sunlight shines straight down each column and block light shines out from tiles like the altar.
+    Both spread sideways, one level dimmer per step. Each tile keeps both values in a single byte,
+    sunlight in the high nibble and block light in the low one.
+    """
+    def __init__(self, tiles: np.ndarray):
+        self.tiles = tiles
+        self.light = np.zeros(tiles.shape, np.uint8)
+        self.relight(0, tiles.shape[0], 0, tiles.shape[1])
+
+    @staticmethod
+    def affects_light(old: Tile, new: Tile) -> bool:
+        """Return whether replacing one tile with another can change the light around it."""
+        return transparent_table[old] != transparent_table[new] or tile_emission[old] != tile_emission[new]
+
+    def level(self, pos: tuple[int, int, int]) -> int:
+        """Return the light level at a position, which is the brighter of the sunlight and block light.
+
+        Everything above the world is in full sunlight.
+        """
+        if pos[2] >= self.tiles.shape[2]:
+            return MAX_LIGHT
+        light = int(self.light[pos])
+        return max(light >> 4, light & 0xF)
+
+    def relight(self, x_min: int, x_max: int, y_min: int, y_max: int) -> None:
+        """Recalculate the light in every column of the given area.
+
+        The light just outside the area is left alone and shines into it.
+        """
+        width, height = self.tiles.shape[:2]
+        # Take a ring of columns around the area, so the light outside can shine in.
+        left, right = max(x_min - 1, 0), min(x_max + 1, width)
+        top, bottom = max(y_min - 1, 0), min(y_max + 1, height)
+        area = slice(x_min - left, x_max - left), slice(y_min - top, y_max - top)
+        tiles = self.tiles[left:right, top:bottom]
+        light = self.light[left:right, top:bottom]
+        transparent = transparent_table[tiles]
+        inside = np.zeros(tiles.shape, bool)
+        inside[area] = True
+        # Sunlight goes straight down until it hits something that blocks it.
+        direct = np.logical_and.accumulate(transparent[..., ::-1], axis=-1)[..., ::-1]
+        sun = np.where(inside, np.where(direct, MAX_LIGHT, 0), light >> 4).astype(np.uint8)
+        block = np.where(inside, tile_emission[tiles], light & 0xF).astype(np.uint8)
+        sun = propagate(sun, transparent, inside)
+        block = propagate(block, transparent, inside)
+        light[area] = (sun[area] << 4) | block[area]
+
+    def update(self, positions: Iterable[tuple[int, int, int]]) -> None:
+        """Relight only the area around some changed positions, as far as light could reach from them."""
+        positions = np.array(list(positions), np.intp).reshape(-1, 3)
+        if not len(positions):
+            return
+        x_min, y_min = np.maximum(positions[:, :2].min(axis=0) - MAX_LIGHT, 0)
+        x_max, y_max = np.minimum(positions[:, :2].max(axis=0) + MAX_LIGHT + 1, self.tiles.shape[:2])
+        self.relight(int(x_min), int(x_max), int(y_min), int(y_max))
@@ -1,21 +1,40 @@
 #!/usr/bin/env python3
 # -*- coding: utf8 -*-
 
+import argparse
 import sys
 from pathlib import Path
 import random
 import time
 
+import numpy as np
 import pygame as pg
 
 import utils
-from generation import generate_world, get_tile
+from dungeon import DungeonGenerator
+from generation import generate_world, get_player_spawn_pos, get_sea_level, world_to_array
 from colors import Color, Image, image_scheme
-from tiles import Tile, prop_tiles, tile_graphics, passable_tiles, slope_tiles
+from columns import ColumnIndex
+from entities import EntityStore, EntityKind, entity_graphics
+from lighting import LightEngine, shade
+from noisecache import NoiseCache
+from overview import OverviewMap
+from streaming import ChunkClient, parse_address, stream_world
+from water import WaterSimulation
+from tiles import Tile, TileFlag, tile_graphics, tile_depth_shades, has_flag, MAX_SHADE_DEPTH
+
+from typing import Iterator, NamedTuple, Optional
 
 
 SCREEN_SIZE = pg.Vector2(800, 600)
-WORLD_SIZE = (64, 64, 16)
+WORLD_SIZE = (64, 64, 32)
+SEA_LEVEL = get_sea_level(WORLD_SIZE)
+MINIMAP_SIZE = 160
+VILLAGER_COUNT = 40
+MONSTER_COUNT = 15
+# How many noise tiles to keep in memory, and the folder to also keep them in between runs, or None for memory only.
+NOISE_CACHE_TILES = 64
+NOISE_CACHE_DIR = None
 
 # PATH_TO_FONT, FONT_SIZE_IN_PIXELS, SCHEME_KEY
 font_info = (
@@ -24,7 +43,20 @@ font_info = (
 )
 
 
-def main() -> None:
+class WorldState(NamedTuple):
+    """Everything that is set up on top of a newly generated or streamed world."""
+    tiles: np.ndarray
+    column_index: ColumnIndex
+    overview: OverviewMap
+    water: WaterSimulation
+    light: LightEngine
+    dungeon: Optional[DungeonGenerator]
+    player_pos: pg.Vector3
+    entities: EntityStore
+
+
+def main(server: Optional[tuple[str, int]] = None) -> None:
+    """Run the game. Given a (HOST, PORT), the world is streamed from a server run by streaming.py instead."""
     # Initialize pygame and set up key repeat.
     pg.init()
     pg.key.set_repeat(500, 100)
@@ -47,12 +79,13 @@ def main() -> None:
     # The starting seed is always the same for testing purposes.
     seed = 1234
     seed_surf = font.render(f"Seed: {seed}", True, Color.WHITE, Color.BLACK)
+    noise_cache = NoiseCache(NOISE_CACHE_TILES, NOISE_CACHE_DIR and Path(NOISE_CACHE_DIR))
     gen_time = time.monotonic_ns()
 
-    def display_world_generation() -> list[list[list[Tile]]]:
+    def display_world_generation(steps: Iterator[str | list[list[list[Tile]]]]) -> list[list[list[Tile]]]:
         """Display the world generation on the screen as it happens."""
         line_counter = -2
-        for item in generate_world(WORLD_SIZE, seed):
+        for item in steps:
             if not isinstance(item, str):
                 return item
             pg.event.pump()  # Add quit event handling back in if world gen gets really long.
@@ -62,19 +95,46 @@ def main() -> None:
             line_counter += 1
 
     # Generate the world and remember how long it took to generate.
-    world = display_world_generation()
+    client = None
+    if server is None:
+        world = display_world_generation(generate_world(WORLD_SIZE, seed, noise_cache))
+    else:
+        # Start with a stand-in world from the server's heightmap. Chunks replace it as they arrive.
+        client = ChunkClient(*server)
+        world = display_world_generation(stream_world(client))
+        seed = client.info.seed
+        seed_surf = font.render(f"Seed: {seed} from {server[0]}:{server[1]}", True, Color.WHITE, Color.BLACK)
     gen_time = time.monotonic_ns() - gen_time
 
-    # Get a spawn point for the player.
-    player_pos = pg.Vector3()
-    random.seed(seed)
-    attempts = 100  # 100 attempts until we give up and place the player at (0, 0, 0).
-    while attempts > 0:
-        x, y = random.randrange(len(world)), random.randrange(len(world[0]))
-        if world[x][y][7] is not Tile.WATER and world[x][y][8] in (Tile.AIR, Tile.RED_FLOWER, Tile.YELLOW_FLOWER):
-            player_pos = pg.Vector3(x, y, 8)
-            break
-        attempts -= 1
+    def setup_world(world: list[list[list[Tile]]], seed: int) -> WorldState:
+        """Set up everything that works on a new world, then find the player a spawn point and populate it."""
+        # The column index and overview map work on a NumPy copy of the world.
+        tiles = world_to_array(world)
+        column_index = ColumnIndex(tiles)
+        overview = OverviewMap(tiles, column_index)
+        water = WaterSimulation(tiles)
+        light = LightEngine(tiles)
+        # The dungeon levels under the altar room are only built once something goes down to them.
+        # A server sends them already built.
+        dungeon = DungeonGenerator.from_altar(tiles, seed) if client is None else None
+        # Get a spawn point for the player.
+        random.seed(seed)
+        if client is None:
+            player_pos = pg.Vector3(get_player_spawn_pos(SEA_LEVEL, world, random))
+        else:
+            player_pos = pg.Vector3(client.info.spawn)
+        entities = EntityStore(tiles, seed)
+        entities.spawn(column_index, VILLAGER_COUNT, EntityKind.VILLAGER)
+        entities.spawn(column_index, MONSTER_COUNT, EntityKind.MONSTER)
+        return WorldState(tiles, column_index, overview, water, light, dungeon, player_pos, entities)
+
+    state = setup_world(world, seed)
+    player_pos = state.player_pos
+    # 0 hides the map, 1 shows the minimap and 2 shows the full screen map.
+    map_mode = 0
+    # The deep view looks down through any number of empty z-levels instead of just two.
+    deep_view = False
+    view_z = None
 
     # Calculate the camera center, and set the view variables.
     # z_level should be part of the camera.
@@ -82,6 +142,20 @@ def main() -> None:
     camera = player_pos.xy - camera_center
     z_level = int(player_pos.z)
 
+    def sync_tiles(positions: list[tuple[int, int, int]]) -> None:
+        """Copy changed tiles from the NumPy array back into the world and update everything that depends on them."""
+        if not positions:
+            return
+        relight = []
+        for pos_x, pos_y, pos_z in positions:
+            old, world[pos_x][pos_y][pos_z] = world[pos_x][pos_y][pos_z], Tile(state.tiles[pos_x, pos_y, pos_z])
+            if LightEngine.affects_light(old, world[pos_x][pos_y][pos_z]):
+                relight.append((pos_x, pos_y, pos_z))
+        columns = {pos[:2] for pos in positions}
+        state.column_index.update_columns(columns)
+        state.overview.update_columns(columns)
+        state.light.update(relight)
+
     def get_scheme_image(image: Image, color: tuple[int, int, int]) -> pg.Surface:
         """Utility function for getting a font-agnostic image."""
         return tile_loader.get_tile(image_scheme[current_scheme][image], color)
@@ -96,60 +170,65 @@ def main() -> None:
         world_x, world_y = int(x + camera.x), int(y + camera.y)
         if (tile := utils.in_bounds3d((world_x, world_y, z_level), world)) is False:
             return  # Don't draw any out of bounds tiles.
-        # Draw the tile to the screen.
+        # Draw the tile to the screen, tinted by the light shining on top of it.
         if tile is not Tile.AIR:
             # These are the side perspective tiles.
-            screen.blit(utils.make_color_image(tile_loader.tile_size, tile_graphics[tile][2]),
+            level = state.light.level((world_x, world_y, z_level + 1))
+            screen.blit(utils.make_color_image(tile_loader.tile_size, shade(tile_graphics[tile][2], level)),
                         (x * tile_loader.tile_size[0], y * tile_loader.tile_size[1]))
-            return get_scheme_image(tile_graphics[tile][0], tile_graphics[tile][1])
+            return get_scheme_image(tile_graphics[tile][0], shade(tile_graphics[tile][1], level))
+        level = state.light.level((world_x, world_y, z_level))
         if z_level > 0:
             # These are the top perspective tiles.
             tile = world[world_x][world_y][z_level - 1]
             if tile is not Tile.AIR:
-                return get_scheme_image(tile_graphics[tile][3], tile_graphics[tile][4])
+                return get_scheme_image(tile_graphics[tile][3], shade(tile_graphics[tile][4], level))
         if z_level > 1:
             # These are the below perspective tiles.
             tile = world[world_x][world_y][z_level - 2]
-            if tile not in prop_tiles:  # Props look as though they are down a z-level anyway.
-                return get_scheme_image(tile_graphics[tile][3], Color.darken(tile_graphics[tile][4]))
+            if not has_flag(tile, TileFlag.PROP):  # Props look as though they are down a z-level anyway.
+                level = state.light.level((world_x, world_y, z_level - 1))
+                return get_scheme_image(tile_graphics[tile][3], shade(Color.darken(tile_graphics[tile][4]), level))
+
+    def get_deep_tile_image() -> pg.Surface | None:
+        """Like get_tile_image, but the tile is the first non-air tile at any depth, looked up in view_z."""
+        if (tile_z := view_z[x, y]) < 0:
+            return  # Out of bounds or nothing but air below.
+        world_x, world_y = int(x + camera.x), int(y + camera.y)
+        tile = world[world_x][world_y][tile_z]
+        level = state.light.level((world_x, world_y, tile_z + 1))
+        if tile_z == z_level:
+            # These are the side perspective tiles.
+            screen.blit(utils.make_color_image(tile_loader.tile_size, shade(tile_graphics[tile][2], level)),
+                        (x * tile_loader.tile_size[0], y * tile_loader.tile_size[1]))
+            return get_scheme_image(tile_graphics[tile][0], shade(tile_graphics[tile][1], level))
+        # These are the top perspective tiles, darkened by how far down they are.
+        image, color = tile_depth_shades[tile][min(z_level - tile_z, MAX_SHADE_DEPTH) - 1]
+        return get_scheme_image(image, shade(color, level))
 
     def move_player(direction: tuple[int, int, int]):
         """Move the player in a direction.
 
-        Movement is not allowed into solid blocks or open air.
-        Up and down movement on slope-like tiles is handled here.
+        The player moves by the same rules as the entities, which also handle going up and down slopes.
+        Tiles an entity is standing on are blocked.
         """
-        # Check for blocked movement.
-        if (try_tile := get_tile(world, player_pos.xyz + direction)) in passable_tiles:
-            # Detect pits.
-            if try_tile is Tile.AIR:
-                # Go downstairs.
-                if get_tile(world, player_pos.xyz + direction + (0, 0, -1)) in slope_tiles:
-                    player_pos.xyz += direction
-                    player_pos.xyz += (0, 0, -1)
-                    return
-                # Don't fall in pits.
-                if get_tile(world, player_pos.xyz + direction + (0, 0, -1)) in passable_tiles:
-                    return
-            # Occupy the vacant tile.
-            player_pos.xyz += direction
-        # Check for going upstairs.
-        elif get_tile(world, player_pos) in slope_tiles:
-            # If there is air above the player and the tile they will be on is passable, it is a legal move.
-            if (get_tile(world, player_pos.xyz + (0, 0, 1)) is Tile.AIR and
-                    get_tile(world, player_pos.xyz + direction + (0, 0, 1)) in passable_tiles):
-                player_pos.xyz += direction
-                player_pos.xyz += (0, 0, 1)
+        moved = state.entities.resolve_moves(np.array([player_pos], np.int32), np.array([direction], np.int32))[0]
+        if not state.entities.occupied(moved):
+            player_pos.xyz = moved.tolist()
 
     # Enter the main game loop.
     while True:
         for event in pg.event.get():
             # Handle quit events.
             if event.type == pg.QUIT:
+                if client is not None:
+                    client.close()
                 pg.quit()
                 sys.exit()
             if event.type == pg.KEYDOWN:
                 if event.key == pg.K_ESCAPE:
+                    if client is not None:
+                        client.close()
                     pg.quit()
                     sys.exit()
                 if event.key == pg.K_F4:  # Toggle full screen.
@@ -164,25 +243,14 @@ def main() -> None:
                     current_scheme = font_info[current_font][2]
                     camera_center = pg.Vector2(screen.size).elementwise() / tile_loader.tile_size // 2  # noqa
                     camera = player_pos.xy - camera_center
-                if event.key == pg.K_SPACE:  # Generate a new world.
-                    # There is a lot of duplicated code here that needs fixing.
+                if event.key == pg.K_SPACE and client is None:  # Generate a new world, unless it is streamed.
                     seed = random.getrandbits(64)
                     seed_surf = font.render(f"Seed: {seed}", True, Color.WHITE, Color.BLACK)
                     gen_time = time.monotonic_ns()
-                    world = display_world_generation()
+                    world = display_world_generation(generate_world(WORLD_SIZE, seed, noise_cache))
                     gen_time = time.monotonic_ns() - gen_time
-
-                    player_pos = pg.Vector3()
-                    random.seed(seed)
-                    attempts = 100
-                    while attempts > 0:
-                        x, y = random.randrange(len(world)), random.randrange(len(world[0]))
-                        if world[x][y][7] is not Tile.WATER and world[x][y][8] in (
-                           Tile.AIR, Tile.RED_FLOWER, Tile.YELLOW_FLOWER):
-                            player_pos = pg.Vector3(x, y, 8)
-                            break
-                        attempts -= 1
-
+                    state = setup_world(world, seed)
+                    player_pos = state.player_pos
                     camera = player_pos.xy - camera_center
                     z_level = int(player_pos.z)
                 # Move the player.
@@ -214,25 +282,71 @@ def main() -> None:
                 # Move the camera up and down.
                 if event.key == pg.K_EQUALS:
                     z_level += 1
-                    z_level = min(WORLD_SIZE[2] - 1, z_level)
+                    z_level = min(len(world[0][0]) - 1, z_level)
                 if event.key == pg.K_MINUS:
                     z_level -= 1
                     z_level = max(0, z_level)
+                if event.key == pg.K_v:  # Toggle the deep view.
+                    deep_view = not deep_view
+                if event.key == pg.K_m:  # Cycle through the map modes.
+                    map_mode += 1
+                    map_mode %= 3
 
         clock.tick()  # Detect fps.
 
+        # Ask for the chunks around the view and ahead of it, and fill in the ones that arrived.
+        if client is not None:
+            client.prefetch(camera + camera_center)
+            changed = client.update(state.tiles)
+            sync_tiles(changed)
+            state.water.wake(changed)
+
+        # Build the dungeon levels the player or the camera just reached.
+        if state.dungeon is not None:
+            changed = state.dungeon.ensure(min(z_level, int(player_pos.z)))
+            sync_tiles(changed)
+            state.water.wake(changed)
+
+        # Let the water flow. It ticks at its own rate, no matter the frame rate.
+        sync_tiles(state.water.update(clock.get_time() / 1000))
+        # Let the villagers and monsters move around.
+        state.entities.update(clock.get_time() / 1000, player_pos)
+
         screen.fill(Color.BLACK)  # Clear the screen for drawing.
 
         # Draw the tiles.
-        for x in range(screen.width // tile_loader.tile_size[0]):
-            for y in range(screen.height // tile_loader.tile_size[1]):
-                if tile_image := get_tile_image():
+        view_size = screen.width // tile_loader.tile_size[0], screen.height // tile_loader.tile_size[1]
+        if deep_view:
+            # Find the visible tile of every on-screen column at once.
+            view_z = state.column_index.first_below_view(z_level, camera, view_size)
+        for x in range(view_size[0]):
+            for y in range(view_size[1]):
+                if tile_image := get_deep_tile_image() if deep_view else get_tile_image():
                     screen.blit(tile_image, (x * tile_loader.tile_size[0], y * tile_loader.tile_size[1]))
 
+        # Draw the entities on the screen and on this z-level.
+        for entity in state.entities.in_view(camera, view_size, z_level):
+            image, color = entity_graphics[state.entities.kinds[entity]]
+            screen.blit(tile_loader.get_tile(image_scheme[current_scheme][image], color, None),
+                        (pg.Vector2(state.entities.positions[entity][:2].tolist()) - camera).elementwise() *
+                        tile_loader.tile_size)  # noqa
+
         # Draw the player.
         if z_level == int(player_pos.z):
             screen.blit(get_player_image(), (player_pos.xy - camera).elementwise() * tile_loader.tile_size)  # noqa
 
+        # Draw the overview map on top of the tiles.
+        if map_mode:
+            view = pg.Rect(camera, pg.Vector2(screen.size).elementwise() // tile_loader.tile_size)  # noqa
+            if map_mode == 1:
+                map_rect = pg.Rect(0, 0, MINIMAP_SIZE, MINIMAP_SIZE * len(world[0]) // len(world))
+                map_rect.topright = screen.width - 10, 10
+            else:
+                scale = min(screen.width / len(world), screen.height / len(world[0]))
+                map_rect = pg.Rect(0, 0, len(world) * scale, len(world[0]) * scale)
+                map_rect.center = screen.get_rect().center
+            state.overview.draw(screen, map_rect, view, player_pos.xy)
+
         # Display the debug info and flip the screen.
         screen.blit(seed_surf, (0, 0))
         fps_surf = font.render(f"Gen: {gen_time // 1000000}ms\nFPS: {clock.get_fps():.2f}\nCamera Z: {z_level}"
@@ -244,4 +358,7 @@ def main() -> None:
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Generate a world and explore it.")
+    parser.add_argument("server", nargs="?", type=parse_address, metavar="HOST:PORT",
+                        help="explore a world served by streaming.py, instead of generating one")
+    main(parser.parse_args().server)
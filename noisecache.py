@@ -0,0 +1,101 @@
+from collections import OrderedDict
+import os
+from pathlib import Path
+
+import numpy as np
+import opensimplex
+
+from typing import Optional, Sequence
+
+
+# (SEED, LAYER, SCALE, OFFSET, TILE) where TILE is the (x, y) number of the tile in the grid of tiles.
+TileKey = tuple[int, str, float, tuple[int, int], tuple[int, int]]
+
+
+def noise_grid(size: Sequence[int], scale: float = 1.0, offset: tuple[int, int] = (0, 0),
+               start: tuple[int, int] = (0, 0)) -> np.ndarray:
+    """Generate a 2D float32 array of noise values for the area of the given size starting at ``start``.
+
+    Uses the seed last given to opensimplex. Each point is sampled at ``(start + pos) * scale + offset``,
+    so an area gets the same values no matter which bigger area it is cut from.
+    """
+    xs = (np.arange(size[0]) + start[0]) * scale + offset[0]
+    ys = (np.arange(size[1]) + start[1]) * scale + offset[1]
+    # opensimplex indexes its result [y][x], while the world is indexed [x][y].
+    return opensimplex.noise2array(xs, ys).T.astype(np.float32)
+
+
+class NoiseCache:
+    """Utility class for remembering noise that was already generated, so revisiting a seed skips the work.
+
+    Noise is stored in square tiles, each keyed by the seed, layer name, scale, offset and the tile's
+    place in the grid. The most recently used tiles are kept in memory. If a directory is given,
+    every tile is also saved there as a float32 ``.npy`` file and memory-mapped when it is needed again.
+    """
+    TILE_SIZE = 64
+
+    def __init__(self, max_tiles: int = 64, directory: Optional[Path] = None):
+        self.max_tiles = max_tiles
+        self.directory = directory
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+        self.tiles: OrderedDict[TileKey, np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: TileKey) -> Path:
+        """Return the file a tile is saved in."""
+        seed, layer, scale, offset, tile = key
+        return self.directory / f"{seed}_{layer}_{scale!r}_{offset[0]}_{offset[1]}_{tile[0]}_{tile[1]}.npy"
+
+    def remember(self, key: TileKey, values: np.ndarray) -> None:
+        """Put a tile in memory, forgetting the least recently used tiles if there are too many."""
+        self.tiles[key] = values
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+
+    def tile(self, key: TileKey) -> np.ndarray:
+        """Return the noise for a tile, from memory, then disk, and only generating it as a last resort.
+
+        Generated tiles use the seed last given to opensimplex, so it has to match the seed in the key.
+        """
+        if key in self.tiles:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        if self.directory is not None and (path := self.path(key)).exists():
+            self.hits += 1
+            values = np.load(path, mmap_mode="r")
+        else:
+            self.misses += 1
+            _, _, scale, offset, (tile_x, tile_y) = key
+            values = noise_grid((self.TILE_SIZE, self.TILE_SIZE), scale, offset,
+                                 (tile_x * self.TILE_SIZE, tile_y * self.TILE_SIZE))
+            if self.directory is not None:
+                # Write to a temporary file first, so a half written tile is never loaded.
+                temp_path = path.with_suffix(".tmp")
+                with open(temp_path, "wb") as file:
+                    np.save(file, values)
+                os.replace(temp_path, path)
+        self.remember(key, values)
+        return values
+
+    def region(self, seed: int, layer: str, size: Sequence[int], scale: float = 1.0,
+               offset: tuple[int, int] = (0, 0), start: tuple[int, int] = (0, 0)) -> np.ndarray:
+        """Return the same values as ``noise_grid`` for an area, pieced together from cached tiles."""
+        result = np.empty((size[0], size[1]), np.float32)
+        first_x, first_y = start[0] // self.TILE_SIZE, start[1] // self.TILE_SIZE
+        last_x, last_y = (start[0] + size[0] - 1) // self.TILE_SIZE, (start[1] + size[1] - 1) // self.TILE_SIZE
+        for tile_x in range(first_x, last_x + 1):
+            for tile_y in range(first_y, last_y + 1):
+                values = self.tile((seed, layer, scale, tuple(offset), (tile_x, tile_y)))
+                # The part of the tile that overlaps the area, in area coordinates.
+                left, top = max(tile_x * self.TILE_SIZE - start[0], 0), max(tile_y * self.TILE_SIZE - start[1], 0)
+                right = min((tile_x + 1) * self.TILE_SIZE - start[0], size[0])
+                bottom = min((tile_y + 1) * self.TILE_SIZE - start[1], size[1])
+                tile_left = start[0] + left - tile_x * self.TILE_SIZE
+                tile_top = start[1] + top - tile_y * self.TILE_SIZE
+                result[left:right, top:bottom] = values[tile_left:tile_left + right - left,
+                                                        tile_top:tile_top + bottom - top]
+        return result
@@ -0,0 +1,65 @@
+import numpy as np
+import pygame as pg
+
+from colors import Color
+from columns import ColumnIndex
+from tiles import Tile, tile_top_colors
+
+from typing import Iterable
+
+
+class OverviewMap:
+    """Utility class for drawing the whole world at one pixel per column.
+
+    The colors are looked up for every column at once and written straight into a Surface,
+    so this stays cheap even for very large worlds. Scale the surface to make a minimap or full map.
+    The top surface of each column comes from the column index, which must be updated before the map.
+    """
+    def __init__(self, tiles: np.ndarray, index: ColumnIndex):
+        self.tiles = tiles
+        self.index = index
+        self.surface = pg.Surface(tiles.shape[:2])
+        self.surface_z = np.empty(tiles.shape[:2], np.int32)
+        self._scaled: pg.Surface | None = None
+        self.redraw()
+
+    def surface_tiles(self) -> np.ndarray:
+        """Return the top surface tile ID of every column, with air for empty columns."""
+        x, y = np.indices(self.surface_z.shape)
+        return np.where(self.surface_z >= 0, self.tiles[x, y, self.surface_z], Tile.AIR)
+
+    def redraw(self) -> None:
+        """Recalculate the top surface of every column and redraw the whole map."""
+        self.surface_z[:] = self.index.first_below(self.tiles.shape[2] - 1)
+        pg.surfarray.blit_array(self.surface, tile_top_colors[self.surface_tiles()])
+        self._scaled = None
+
+    def update_columns(self, columns: Iterable[tuple[int, int]]) -> None:
+        """Redraw only the given (x, y) columns after the tiles in them were changed."""
+        columns = np.array(list(columns), np.intp).reshape(-1, 2)
+        if not len(columns):
+            return
+        xs, ys = columns[:, 0], columns[:, 1]
+        self.surface_z[xs, ys] = self.index.first_below(self.tiles.shape[2] - 1, self.index.mask[xs, ys])
+        z = self.surface_z[xs, ys]
+        tiles = np.where(z >= 0, self.tiles[xs, ys, z], Tile.AIR)
+        pixels = pg.surfarray.pixels3d(self.surface)
+        pixels[xs, ys] = tile_top_colors[tiles]
+        del pixels  # The surface stays locked until the pixel array is released.
+        self._scaled = None
+
+    def scaled(self, size: tuple[int, int]) -> pg.Surface:
+        """Return the map scaled to the given size. The result is cached until the map changes."""
+        if self._scaled is None or self._scaled.size != tuple(size):
+            self._scaled = pg.transform.scale(self.surface, size)
+        return self._scaled
+
+    def draw(self, screen: pg.Surface, rect: pg.Rect, camera: pg.Rect, player: pg.Vector2) -> None:
+        """Draw the map into ``rect`` on the screen, with the camera view and player marked on it."""
+        screen.blit(self.scaled(rect.size), rect)
+        scale = pg.Vector2(rect.size).elementwise() / self.surface.size  # noqa
+        view = pg.Rect(rect.x + camera.x * scale.x, rect.y + camera.y * scale.y,
+                       camera.width * scale.x, camera.height * scale.y)
+        pg.draw.rect(screen, Color.WHITE, view.clip(rect), 1)
+        pg.draw.circle(screen, Color.RED, rect.topleft + player.elementwise() * scale, max(2, int(scale.x)))  # noqa
+        pg.draw.rect(screen, Color.GRAY, rect, 1)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+"""Serve a generated world to game clients over a socket, and fetch it back on the client side.
+
+Run this file to generate a world once and serve it, then start ``main.py HOST:PORT`` to explore it.
+
+Every message starts with a ``HEADER`` of (KIND, STATUS, X, Y, LENGTH) followed by LENGTH bytes of payload.
+Clients send requests with no payload, and the server answers each one with the same KIND, X and Y.
+X and Y are chunk coordinates, so chunk (1, 2) covers tiles from (CHUNK_SIZE, 2 * CHUNK_SIZE) onwards.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+from enum import IntEnum, auto
+import queue
+import random
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from columns import ColumnIndex
+from dungeon import DungeonGenerator
+from generation import generate_world, get_player_spawn_pos, get_sea_level, world_to_array, array_to_world
+from tiles import Tile
+
+from typing import Iterator, NamedTuple, Optional, Sequence
+
+
+DEFAULT_PORT = 8765
+CHUNK_SIZE = 16
+
+HEADER = struct.Struct("!BBiiI")
+# WIDTH, HEIGHT, DEPTH, CHUNK_SIZE, SEED, SPAWN_X, SPAWN_Y, SPAWN_Z
+WORLD_INFO = struct.Struct("!HHHHQhhh")
+
+
+class MessageKind(IntEnum):
+    """Utility class for storing the kinds of messages that can be sent."""
+    WORLD_INFO = auto()  # Payload is a WORLD_INFO struct.
+    CHUNK = auto()  # Payload is the compressed uint8 tile IDs of a chunk, indexed [x][y][z].
+    HEIGHTMAP = auto()  # Payload is the compressed int8 z of the top tile of each column, then its uint8 tile ID.
+
+
+class Status(IntEnum):
+    """Utility class for storing whether a request worked. The payload of an error is a UTF-8 message."""
+    OK = 0
+    ERROR = 1
+
+
+class WorldInfo(NamedTuple):
+    size: tuple[int, int, int]
+    chunk_size: int
+    seed: int
+    spawn: tuple[int, int, int]
+
+
+def chunk_bounds(size: Sequence[int], chunk_size: int, chunk: tuple[int, int]) -> tuple[slice, slice]:
+    """Return the x and y slices of the tiles in a chunk. Chunks on the far edges of the world can be smaller."""
+    x, y = chunk[0] * chunk_size, chunk[1] * chunk_size
+    return slice(x, min(x + chunk_size, size[0])), slice(y, min(y + chunk_size, size[1]))
+
+
+def placeholder_tiles(heights: np.ndarray, tops: np.ndarray, depth: int) -> np.ndarray:
+    """Build a stand-in world from a heightmap, with the top tile of each column on top of solid stone.
+
+    It looks the same as the real world from above, so it can be shown until the real chunks arrive.
+    """
+    z = np.arange(depth)
+    tiles = np.where(z < heights[..., None], Tile.STONE, Tile.AIR).astype(np.uint8)
+    return np.where(z == heights[..., None], tops[..., None], tiles).astype(np.uint8)
+
+
+class ChunkServer:
+    """Utility class for serving the chunks and heightmap of a world to any number of clients.
+
+    The world never changes on the server, so each chunk is only compressed once.
+    """
+    def __init__(self, tiles: np.ndarray, seed: int, spawn: tuple[int, int, int], chunk_size: int = CHUNK_SIZE):
+        self.tiles = tiles
+        self.info = WORLD_INFO.pack(*tiles.shape, chunk_size, seed, *spawn)
+        self.chunk_size = chunk_size
+        self.chunk_count = -(-tiles.shape[0] // chunk_size), -(-tiles.shape[1] // chunk_size)
+        self.heights = ColumnIndex(tiles).first_below(tiles.shape[2] - 1).astype(np.int8)
+        x, y = np.indices(self.heights.shape)
+        self.tops = np.where(self.heights >= 0, tiles[x, y, self.heights], Tile.AIR).astype(np.uint8)
+        self.compressed: dict[tuple[MessageKind, int, int], bytes] = {}
+
+    def payload(self, kind: MessageKind, x: int, y: int) -> bytes:
+        """Return the payload answering a request, compressing it the first time it is asked for."""
+        if kind == MessageKind.WORLD_INFO:
+            return self.info
+        if not (0 <= x < self.chunk_count[0] and 0 <= y < self.chunk_count[1]):
+            raise ValueError(f"Chunk {x}, {y} is outside the world.")
+        if (kind, x, y) not in self.compressed:
+            area = chunk_bounds(self.tiles.shape, self.chunk_size, (x, y))
+            if kind == MessageKind.CHUNK:
+                data = self.tiles[area].tobytes()
+            else:
+                data = self.heights[area].tobytes() + self.tops[area].tobytes()
+            self.compressed[kind, x, y] = zlib.compress(data)
+        return self.compressed[kind, x, y]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Answer the requests from one client, in order, until it disconnects."""
+        try:
+            while True:
+                kind, _, x, y, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if length:
+                    # Requests never have a payload, so the rest of the stream can't be trusted.
+                    message = b"Requests can't have a payload."
+                    writer.write(HEADER.pack(kind, Status.ERROR, x, y, len(message)) + message)
+                    await writer.drain()
+                    break
+                try:
+                    payload, status = self.payload(MessageKind(kind), x, y), Status.OK
+                except ValueError as error:  # Also covers unknown message kinds.
+                    payload, status = str(error).encode(), Status.ERROR
+                writer.write(HEADER.pack(kind, status, x, y, len(payload)) + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # The client went away.
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> asyncio.Server:
+        """Start listening for clients. Use port 0 to pick any free port."""
+        return await asyncio.start_server(self.handle, host, port)
+
+
+class ChunkClient:
+    """Utility class for fetching a world from a ``ChunkServer`` over one connection that stays open.
+
+    The connection runs on an asyncio event loop in a background thread, so the game never waits on the network.
+    Chunks are requested around the center of the view and further ahead in the direction it is moving,
+    then handed back to the game by ``update`` as they arrive. Each chunk is only ever fetched once.
+    """
+    LOAD_RADIUS = 2  # Chunks around the center of the view to load, in every direction.
+    PREFETCH_DISTANCE = 3  # How many chunks ahead of the movement direction to load.
+
+    def __init__(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        self.host, self.port = host, port
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.pending: dict[tuple[int, int, int], asyncio.Future] = {}
+        self.info: Optional[WorldInfo] = None
+        self.requested: set[tuple[int, int]] = set()  # Chunks that are loaded or on their way.
+        self.arrived: queue.SimpleQueue[tuple[tuple[int, int], np.ndarray]] = queue.SimpleQueue()
+        self.last_center: Optional[tuple[int, int]] = None
+        self.direction = 0, 0
+
+    def connect(self, timeout: float = 10.0) -> WorldInfo:
+        """Open the connection and get the details of the world. This blocks until the server answers."""
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.open(), self.loop).result(timeout)
+        width, height, depth, chunk_size, seed, *spawn = WORLD_INFO.unpack(
+            self.fetch(MessageKind.WORLD_INFO, 0, 0).result(timeout))
+        self.info = WorldInfo((width, height, depth), chunk_size, seed, tuple(spawn))
+        return self.info
+
+    async def open(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.loop.create_task(self.listen())
+
+    async def shutdown(self) -> None:
+        """Cancel the listener and any requests still on their way, then close the connection."""
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass  # The server already went away.
+
+    async def listen(self) -> None:
+        """Hand each answer from the server to the request waiting for it."""
+        try:
+            while True:
+                kind, status, x, y, length = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+                payload = await self.reader.readexactly(length)
+                future = self.pending.pop((kind, x, y))
+                if status == Status.OK:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(ValueError(payload.decode()))
+        except (asyncio.IncompleteReadError, ConnectionError) as error:
+            for future in self.pending.values():
+                future.set_exception(ConnectionError(f"Lost connection to the server: {error!r}"))
+            self.pending.clear()
+
+    async def request(self, kind: MessageKind, x: int, y: int) -> bytes:
+        """Send a request and wait for its answer. Asking again while it is on its way shares the same answer."""
+        if (key := (kind, x, y)) not in self.pending:
+            self.pending[key] = self.loop.create_future()
+            self.writer.write(HEADER.pack(kind, Status.OK, x, y, 0))
+            await self.writer.drain()
+        return await asyncio.shield(self.pending[key])
+
+    def fetch(self, kind: MessageKind, x: int, y: int) -> concurrent.futures.Future:
+        """Send a request from any thread and return a future for its payload."""
+        return asyncio.run_coroutine_threadsafe(self.request(kind, x, y), self.loop)
+
+    def heightmap(self, timeout: float = 30.0) -> tuple[np.ndarray, np.ndarray]:
+        """Fetch the heightmap of the whole world and return the (z, tile ID) of the top tile of each column."""
+        size, chunk_size = self.info.size, self.info.chunk_size
+        chunks = [(x, y) for x in range(-(-size[0] // chunk_size)) for y in range(-(-size[1] // chunk_size))]
+        futures = [self.fetch(MessageKind.HEIGHTMAP, x, y) for x, y in chunks]  # All in flight at once.
+        heights, tops = np.zeros(size[:2], np.int8), np.zeros(size[:2], np.uint8)
+        for chunk, future in zip(chunks, futures):
+            area = chunk_bounds(size, chunk_size, chunk)
+            data = zlib.decompress(future.result(timeout))
+            heights[area] = np.frombuffer(data[:len(data) // 2], np.int8).reshape(heights[area].shape)
+            tops[area] = np.frombuffer(data[len(data) // 2:], np.uint8).reshape(tops[area].shape)
+        return heights, tops
+
+    def request_chunk(self, chunk: tuple[int, int]) -> None:
+        """Start fetching a chunk, unless it is outside the world or already loaded or on its way."""
+        chunk_count = -(-self.info.size[0] // self.info.chunk_size), -(-self.info.size[1] // self.info.chunk_size)
+        if chunk in self.requested or not (0 <= chunk[0] < chunk_count[0] and 0 <= chunk[1] < chunk_count[1]):
+            return
+        self.requested.add(chunk)
+        area = chunk_bounds(self.info.size, self.info.chunk_size, chunk)
+        shape = area[0].stop - area[0].start, area[1].stop - area[1].start, self.info.size[2]
+
+        def received(future: concurrent.futures.Future) -> None:
+            # Chunks that fail to arrive stay as placeholders, rather than being asked for over and over.
+            if not future.cancelled() and future.exception() is None:
+                self.arrived.put((chunk, np.frombuffer(zlib.decompress(future.result()), np.uint8).reshape(shape)))
+        self.fetch(MessageKind.CHUNK, *chunk).add_done_callback(received)
+
+    def prefetch(self, center: Sequence[float]) -> None:
+        """Fetch the chunks around a point, normally the center of the view, and ahead of where it is heading.
+
+        The closest chunks are requested first, so they arrive first.
+        """
+        chunk_size = self.info.chunk_size
+        center = int(center[0]) // chunk_size, int(center[1]) // chunk_size
+        if self.last_center is not None and center != self.last_center:
+            # Only remember the general direction, so moving diagonally looks ahead diagonally.
+            self.direction = (int(np.sign(center[0] - self.last_center[0])),
+                              int(np.sign(center[1] - self.last_center[1])))
+        self.last_center = center
+        around = sorted(((dx, dy) for dx in range(-self.LOAD_RADIUS, self.LOAD_RADIUS + 1)
+                         for dy in range(-self.LOAD_RADIUS, self.LOAD_RADIUS + 1)), key=lambda d: abs(d[0]) + abs(d[1]))
+        for dx, dy in around:
+            self.request_chunk((center[0] + dx, center[1] + dy))
+        if self.direction != (0, 0):
+            for step in range(self.LOAD_RADIUS + 1, self.LOAD_RADIUS + self.PREFETCH_DISTANCE + 1):
+                ahead = center[0] + self.direction[0] * step, center[1] + self.direction[1] * step
+                # Take the chunks either side too, so turning a little doesn't run out of world.
+                for side in range(-1, 2):
+                    self.request_chunk((ahead[0] + side * self.direction[1], ahead[1] + side * self.direction[0]))
+
+    def update(self, tiles: np.ndarray) -> list[tuple[int, int, int]]:
+        """Copy every chunk that arrived since the last call into the tiles and return the positions that changed."""
+        changed = []
+        while not self.arrived.empty():
+            chunk, chunk_tiles = self.arrived.get()
+            area = chunk_bounds(tiles.shape, self.info.chunk_size, chunk)
+            offset = area[0].start, area[1].start, 0
+            changed += [tuple(pos) for pos in (np.argwhere(tiles[area] != chunk_tiles) + offset).tolist()]
+            tiles[area] = chunk_tiles
+        return changed
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Close the connection and stop the background thread."""
+        if not self.thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def stream_world(client: ChunkClient) -> Iterator[str | list[list[list[Tile]]]]:
+    """Connect to the server and build a stand-in world from its heightmap, to be filled in by chunks later.
+
+    Like ``generate_world``, this yields status strings and then the world array.
+    """
+    yield f"Connecting to {client.host}:{client.port}..."
+    info = client.connect()
+    yield "Downloading heightmap..."
+    heights, tops = client.heightmap()
+    yield array_to_world(placeholder_tiles(heights, tops, info.size[2]))
+
+
+def parse_seed(text: str) -> int:
+    """Read a seed from the command line. Seeds are sent to clients as unsigned 64-bit numbers."""
+    try:
+        seed = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} is not a whole number") from None
+    if not 0 <= seed < 2 ** 64:
+        raise argparse.ArgumentTypeError(f"{seed} is not between 0 and {2 ** 64 - 1}")
+    return seed
+
+
+def parse_address(text: str) -> tuple[str, int]:
+    """Read a HOST:PORT address from the command line. The port can be left out to use the default one."""
+    host, _, port = text.rpartition(":") if ":" in text else (text, ":", str(DEFAULT_PORT))
+    if not host:
+        raise argparse.ArgumentTypeError(f"{text!r} has no host, use HOST:PORT")
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise argparse.ArgumentTypeError(f"{port!r} is not a port between 1 and 65535")
+    return host, int(port)
+
+
+def run_server(host: str, port: int, size: tuple[int, int, int], seed: int) -> None:
+    """Generate a world, with every dungeon level built, and serve it until interrupted."""
+    print(f"Generating a {size[0]}x{size[1]}x{size[2]} world with seed {seed}...")
+    world = list(generate_world(size, seed))[-1]
+    tiles = world_to_array(world)
+    if (dungeon := DungeonGenerator.from_altar(tiles, seed)) is not None:
+        dungeon.ensure(0)
+    spawn = get_player_spawn_pos(get_sea_level(size), world, random.Random(seed))
+
+    async def serve() -> None:
+        server = await ChunkServer(tiles, seed, spawn).serve(host, port)
+        print(f"Serving on {host}:{port}.")
+        async with server:
+            await server.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a world and serve it to game clients.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--size", type=int, nargs=3, default=(64, 64, 32), metavar=("WIDTH", "HEIGHT", "DEPTH"))
+    parser.add_argument("--seed", type=parse_seed, default=1234)
+    args = parser.parse_args()
+    run_server(args.host, args.port, tuple(args.size), args.seed)
@@ -1,4 +1,6 @@
-from enum import IntEnum, auto
+from enum import IntEnum, IntFlag, auto
+
+import numpy as np
 
 from colors import Color, Image
 
@@ -29,6 +31,16 @@ class Tile(IntEnum):
     ALTAR = auto()
 
 
+class TileFlag(IntFlag):
+    """Utility class for the bit flags stored for each tile in ``tile_flags``."""
+    PASSABLE = auto()
+    SLOPE = auto()
+    PROP = auto()
+    OPAQUE = auto()
+    LIQUID = auto()
+    GROUND = auto()
+
+
 # These data structures hold tile data, like whether they block movement.
 
 prop_tiles = (
@@ -63,6 +75,33 @@ slope_tiles = (
     Tile.WOOD_STAIRS,
 )
 
+# Light shines through these tiles.
+transparent_tiles = (
+    Tile.AIR,
+    Tile.WATER,
+    Tile.ALTAR,
+    Tile.RED_FLOWER,
+    Tile.YELLOW_FLOWER,
+    Tile.SWAMP_GRASS,
+)
+
+liquid_tiles = (
+    Tile.WATER,
+)
+
+# Natural ground that villagers and monsters can be put on, unlike trees and the roofs of structures.
+ground_tiles = (
+    Tile.STONE,
+    Tile.DIRT,
+    Tile.GRASS,
+    Tile.SAND,
+)
+
+# These tiles give off light, with a brightness from 1 to 15.
+light_tiles = {
+    Tile.ALTAR: 12,
+}
+
 # Each graphic consists of IMAGE, COLOR, BG_COLOR, IMAGE, COLOR.
 # The first three are used for the side perspective, the last two for the top perspective.
 # No tiles from a top perspective should have background color.
@@ -92,3 +131,33 @@ tile_graphics = {
     Tile.SAND_SLOPE: Image.ramp_graphic(Color.SAND),
     Tile.WOOD_RAMP: Image.ramp_graphic(Color.WOOD),
 }
+
+# The deep view darkens top perspective tiles more the further below the camera they are.
+# Each tile gets one precomputed IMAGE, COLOR pair per z-level of depth, starting from one level down.
+MAX_SHADE_DEPTH = 8
+tile_depth_shades = {
+    tile: tuple((graphic[3], Color.darken(graphic[4], depth / MAX_SHADE_DEPTH)) for depth in range(MAX_SHADE_DEPTH))
+    for tile, graphic in tile_graphics.items()
+}
+
+# The tile data above compiled into arrays indexed by tile ID.
+# Index them with a single tile for an O(1) lookup, or with a whole array of tiles to classify them all at once.
+TILE_COUNT = max(Tile) + 1
+tile_flags = np.zeros(TILE_COUNT, np.uint8)
+for _flag, _tiles in ((TileFlag.PASSABLE, passable_tiles), (TileFlag.SLOPE, slope_tiles),
+                      (TileFlag.PROP, prop_tiles), (TileFlag.LIQUID, liquid_tiles), (TileFlag.GROUND, ground_tiles)):
+    tile_flags[list(_tiles)] |= np.uint8(_flag)
+tile_flags[[tile for tile in Tile if tile not in transparent_tiles]] |= np.uint8(TileFlag.OPAQUE)
+tile_emission = np.zeros(TILE_COUNT, np.uint8)
+tile_emission[list(light_tiles)] = list(light_tiles.values())
+# The top perspective COLOR of each tile, black for air. Used to draw whole maps at once.
+tile_top_colors = np.zeros((TILE_COUNT, 3), np.uint8)
+for _tile, _graphic in tile_graphics.items():
+    tile_top_colors[_tile] = _graphic[4]
+# Plain list copy for scalar lookups, since indexing a list is faster than indexing an array.
+tile_flag_list = tile_flags.tolist()
+
+
+def has_flag(tile: Tile, flag: TileFlag) -> bool:
+    """Return whether a tile has all the given flags."""
+    return tile_flag_list[tile] & flag == flag
@@ -64,6 +64,25 @@ def in_bounds3d[T](pos: Sequence[int], array: list[list[list[T]]], no_value=Fals
         return no_value
 
 
+class FixedStep:
+    """Utility class for running something at a fixed number of steps per second, independent of the frame rate.
+
+    At most ``max_steps`` steps are run per update, so a long frame skips steps instead of stalling the next one.
+    """
+    def __init__(self, rate: float, max_steps: int):
+        self.step_length = 1 / rate
+        self.max_steps = max_steps
+        self.time = 0.0
+
+    def advance(self, delta_time: float) -> int:
+        """Add the elapsed time in seconds, and return how many steps should be run now."""
+        self.time += delta_time
+        steps = min(int(self.time // self.step_length), self.max_steps)
+        self.time -= steps * self.step_length
+        self.time = min(self.time, self.step_length)  # Drop any backlog left over from a long frame.
+        return steps
+
+
 class TileLoader:
     """Utility class for clipping and coloring tiles from a sheet."""
     def __init__(self, img_path: Path, tile_size: tuple[int, int]):
@@ -0,0 +1,113 @@
+from collections import deque
+
+import numpy as np
+
+import utils
+from tiles import Tile
+
+from typing import Sequence
+
+# Plain ints, since comparing against the Tile members is several times slower.
+AIR = int(Tile.AIR)
+WATER = int(Tile.WATER)
+
+class WaterSimulation:
+    """Utility class for making water flow through the world.
+
+    Water falls into air below it, and spreads sideways into air once it is resting on something.
+    Only the cells that may still change are kept in the active queue, so settled water costs nothing.
+    The simulation edits the NumPy tile array directly and reports the positions it changed.
+    """
+    TICK_RATE = 8  # Ticks per second, independent of the frame rate.
+    MAX_TICKS_PER_UPDATE = 2  # Skip ticks instead of stalling a frame when we fall behind.
+    # The most time in seconds an update may take out of a frame, however big the flood. Processing an active
+    # cell takes up to CELL_TIME seconds, measured on a 40x40 pit filling up from the sea.
+    FRAME_TIME_LIMIT = 0.004
+    CELL_TIME = 3e-6
+    TICK_BUDGET = int(FRAME_TIME_LIMIT / CELL_TIME / MAX_TICKS_PER_UPDATE)  # The most active cells in a single tick.
+
+    def __init__(self, tiles: np.ndarray, tick_rate: float = TICK_RATE, tick_budget: int = TICK_BUDGET):
+        self.tiles = tiles
+        self.flat = tiles.reshape(-1)  # A view, so writing to it writes to the tile array.
+        # Indexing a memoryview gives plain ints, which is much faster than indexing the array for single cells.
+        self.cells = memoryview(self.flat)
+        self.size = tiles.shape
+        self.tick_budget = tick_budget
+        self.clock = utils.FixedStep(tick_rate, self.MAX_TICKS_PER_UPDATE)
+        self.active = deque()
+        self.queued = bytearray(tiles.size)
+        self.wake_frontier()
+
+    def wake_frontier(self) -> None:
+        """Queue every water cell in the world that can currently flow somewhere."""
+        water = self.tiles == Tile.WATER
+        air = self.tiles == Tile.AIR
+        below_air = np.zeros_like(air)
+        below_air[:, :, 1:] = air[:, :, :-1]
+        side_air = np.zeros_like(air)
+        side_air[1:] |= air[:-1]
+        side_air[:-1] |= air[1:]
+        side_air[:, 1:] |= air[:, :-1]
+        side_air[:, :-1] |= air[:, 1:]
+        for index in np.flatnonzero(water & (below_air | side_air)).tolist():
+            self.queue(index)
+
+    def queue(self, index: int) -> None:
+        """Add a flat cell index to the active queue, unless it is already in it."""
+        if not self.queued[index]:
+            self.queued[index] = 1
+            self.active.append(index)
+
+    def wake(self, positions: Sequence[tuple[int, int, int]]) -> None:
+        """Wake up the water around each position after the world was changed there."""
+        if not positions:
+            return
+        positions = np.array(positions, np.intp)
+        # Every position and its six neighbors, dropping the ones outside the world.
+        offsets = np.array(((0, 0, 0), (1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)), np.intp)
+        around = (positions[:, None] + offsets).reshape(-1, 3)
+        around = around[np.all((around >= 0) & (around < self.size), axis=1)]
+        indices = np.ravel_multi_index(around.T, self.size)
+        for index in np.unique(indices[self.flat[indices] == WATER]).tolist():
+            self.queue(index)
+
+    def fill(self, index: int, changed: list[int]) -> None:
+        """Turn an air cell into water and make it active."""
+        self.cells[index] = WATER
+        changed.append(index)
+        self.queue(index)
+
+    def tick(self) -> list[tuple[int, int, int]]:
+        """Advance the water by one step and return the (x, y, z) positions that became water.
+
+        Only the cells active at the start of the tick are processed, up to the tick budget.
+        Cells that had nowhere to flow are put to sleep until something wakes them.
+        """
+        height, depth = self.size[1], self.size[2]
+        cells = self.cells
+        changed = []
+        for _ in range(min(len(self.active), self.tick_budget)):
+            index = self.active.popleft()
+            self.queued[index] = 0
+            if cells[index] != WATER:
+                continue  # Something replaced the water after it was queued.
+            z = index % depth
+            y = index // depth % height
+            x = index // (depth * height)
+            # Fall down first, then try again next tick to spread out on top of the new water.
+            if z > 0 and cells[index - 1] == AIR:
+                self.fill(index - 1, changed)
+                self.queue(index)
+                continue
+            for neighbor, in_bounds in ((index - depth * height, x > 0), (index + depth * height, x < self.size[0] - 1),
+                                        (index - depth, y > 0), (index + depth, y < height - 1)):
+                if in_bounds and cells[neighbor] == AIR:
+                    self.fill(neighbor, changed)
+        return [tuple(pos) for pos in np.transpose(np.unravel_index(np.array(changed, np.intp), self.size)).tolist()]
+
+    def update(self, delta_time: float) -> list[tuple[int, int, int]]:
+        """Run as many ticks as the elapsed time in seconds calls for and return every changed position."""
+        changed = []
+        for _ in range(self.clock.advance(delta_time)):
+            changed += self.tick()
+        return changed